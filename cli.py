@@ -1,28 +1,40 @@
 # cli.py
 # ------
-import click, json, csv, sys
+import click, re, sys
+from functools import lru_cache
+from importlib import import_module
 from pathlib import Path
 
-# Storage drivers
+# Storage drivers (SQLite and ijson are imported on first use; the JSON codec is storage's,
+# which already picks orjson when it is installed)
 from storage_jsonl import JsonlStorage
-# SQLite is optional; import lazily
-try:
-    from storage_sqlite import SqliteStorage
-    HAVE_SQLITE = True
-except Exception:
-    HAVE_SQLITE = False
-
-from storage import Storage, Recipe
+from storage import Storage, Recipe, json_loads, json_dumpb
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h','--help'])
 
+@lru_cache(maxsize=None)
+def _optional(name: str):
+    """Import an optional module on first use; None if it isn't installed."""
+    try:
+        return import_module(name)
+    except ImportError:
+        return None
+
+# Field parsers: one C-level pass per cell, yielding already-stripped pieces
+_ING_RE = re.compile(r'\s*([^,:]*?)\s*:\s*([^,]*?)\s*(?:,|$)')  # name:qty pairs
+_STEPS_RE = re.compile(r'[^|\s](?:[^|]*[^|\s])?')              # pipe-separated steps
+_TAGS_RE = re.compile(r'[^,\s](?:[^,]*[^,\s])?')               # comma-separated tags
+_ING_NO_QTY_RE = re.compile(r'(?:^|,)\s*([^,:\s][^,:]*?)\s*(?=,|$)')  # ingredient chunk missing ':qty'
+
 def get_store(db: str) -> Storage:
     p = Path(db)
     if p.suffix.lower() == ".jsonl" or p.suffix == "":
         # default to JSONL
         return JsonlStorage(p if p.suffix else p.with_suffix(".jsonl"))
     elif p.suffix.lower() in (".db", ".sqlite", ".sqlite3"):
-        if not HAVE_SQLITE:
+        try:
+            from storage_sqlite import SqliteStorage
+        except Exception:
             raise click.ClickException("SQLite backend not available. Add storage_sqlite.py or use a .jsonl DB.")
         return SqliteStorage(str(p))
     else:
@@ -37,6 +49,8 @@ def cli(ctx, db):
     ctx.ensure_object(dict)
     ctx.obj["DB_PATH"] = db
     ctx.obj["STORE"] = get_store(db)
+    # One store per CLI run, released once the subcommand finishes
+    ctx.call_on_close(ctx.obj["STORE"].close)
 
 # ---------------------------
 # Core commands (storage-backed)
@@ -71,8 +85,7 @@ def init_cmd(ctx, with_samples):
 @click.pass_context
 def list_recipes(ctx):
     """List all recipes."""
-    store: Storage = ctx.obj["STORE"]
-    titles = [r["title"] for r in store.list_recipes()]
+    titles = ctx.obj["STORE"].list_titles()
     if not titles:
         click.echo("No recipes.")
         return
@@ -94,14 +107,12 @@ def add_recipe(ctx, title, ingredients, steps, tags, servings, source_url):
     """Add a new recipe."""
     store: Storage = ctx.obj["STORE"]
     # parse ingredients -> dict
-    ing_map = {}
-    for chunk in [c for c in ingredients.split(",") if c.strip()]:
-        if ":" not in chunk:
-            raise click.ClickException(f"Ingredient must be name:qty, got '{chunk}'")
-        name, qty = chunk.split(":", 1)
-        ing_map[name.strip()] = qty.strip()
-    steps_list = [s.strip() for s in steps.split("|") if s.strip()]
-    tags_list = [t.strip() for t in tags.split(",") if t.strip()]
+    bad = _ING_NO_QTY_RE.search(ingredients)
+    if bad:
+        raise click.ClickException(f"Ingredient must be name:qty, got '{bad.group(1)}'")
+    ing_map = dict(_ING_RE.findall(ingredients))
+    steps_list = _STEPS_RE.findall(steps)
+    tags_list = _TAGS_RE.findall(tags)
     recipe: Recipe = {
         "title": title.strip(),
         "ingredients": ing_map,
@@ -113,7 +124,7 @@ def add_recipe(ctx, title, ingredients, steps, tags, servings, source_url):
     if source_url.strip():
         recipe["source_url"] = source_url.strip()
 
-    if store.get_recipe(recipe["title"]):
+    if store.has_title(recipe["title"]):
         raise click.ClickException(f"Recipe '{recipe['title']}' already exists")
     store.add_recipe(recipe)
     store.save()
@@ -139,16 +150,8 @@ def delete_recipe(ctx, title):
 def random_recipe(ctx, tag, count):
     """Pick random recipe(s)."""
     store: Storage = ctx.obj["STORE"]
-    picks = []
-    if tag:
-        # If multiple tags given, intersect by filtering sequentially
-        pool = store.list_recipes()
-        for tg in tag:
-            pool = [r for r in pool if tg in r.get("tags", [])]
-        from random import sample
-        picks = sample(pool, k=min(count, len(pool))) if pool else []
-    else:
-        picks = store.random_recipes(n=count)
+    # Multiple tags are intersected by the storage backend
+    picks = store.random_recipes(n=count, tag=tag)
 
     if not picks:
         click.echo("No matching recipes.")
@@ -185,10 +188,10 @@ def grocery_cmd(ctx, titles, count, out):
             raise click.ClickException("Provide --titles or a positive --count")
         chosen = store.random_recipes(n=count)
 
+    # The store already merges repeated ingredients; write the list in one go
     lines = store.grocery_list(chosen)
     with open(out, "w", encoding="utf-8") as f:
-        for name, amt in lines:
-            f.write(f"{name} - {amt}\n")
+        f.write("".join(f"{name} - {amt}\n" for name, amt in lines))
     click.echo(f"Wrote grocery list to {out}")
 
 # ---------------------------
@@ -204,39 +207,61 @@ def import_cmd(ctx, fmt, infile):
     store: Storage = ctx.obj["STORE"]
 
     def iter_json():
-        with open(infile, encoding="utf-8") as f:
-            data = json.load(f)
+        ijson = _optional("ijson")
+        if ijson:
+            # Stream array items one at a time instead of loading the whole document
+            with open(infile, "rb") as f:
+                for r in ijson.items(f, "item", use_float=True):
+                    yield _coerce_recipe(r)
+            return
+        with open(infile, "rb") as f:
+            data = json_loads(f.read())
             for r in data:
                 yield _coerce_recipe(r)
 
     def iter_jsonl():
-        with open(infile, encoding="utf-8") as f:
-            for line in f:
-                if line.strip():
-                    yield _coerce_recipe(json.loads(line))
+        # Read raw 1 MiB blocks and split on newlines ourselves; the parser takes bytes
+        with open(infile, "rb") as f:
+            tail = b""
+            for block in iter(lambda: f.read(1 << 20), b""):
+                lines = (tail + block).split(b"\n")
+                tail = lines.pop()
+                for line in lines:
+                    if line.strip():
+                        yield _coerce_recipe(json_loads(line))
+            if tail.strip():
+                yield _coerce_recipe(json_loads(tail))
 
     def iter_csv():
         # CSV header: title,ingredients,steps,tags,(optional)servings,(optional)source_url
+        import csv
         with open(infile, newline="", encoding="utf-8") as f:
-            rd = csv.DictReader(f)
+            rd = csv.reader(f)
+            header = [h.strip().lower() for h in next(rd, [])]
             required = {"title", "ingredients", "steps"}
-            missing = required - set(h.strip().lower() for h in rd.fieldnames or [])
+            missing = required - set(header)
             if missing:
                 raise click.ClickException(f"CSV missing columns: {', '.join(sorted(missing))}")
+            # Resolve column positions once; rows are plain lists
+            col = {h: i for i, h in enumerate(header)}
+            i_title, i_ing, i_steps = col["title"], col["ingredients"], col["steps"]
+            i_tags, i_servings, i_url = col.get("tags"), col.get("servings"), col.get("source_url")
+            width = len(header)
             for row in rd:
+                if not row:
+                    continue
+                if len(row) < width:
+                    row += [""] * (width - len(row))
                 recipe = {
-                    "title": row["title"].strip(),
-                    "ingredients": {
-                        kv.split(":", 1)[0].strip(): kv.split(":", 1)[1].strip()
-                        for kv in row["ingredients"].split(",") if ":" in kv
-                    } if row.get("ingredients") else {},
-                    "steps": [s.strip() for s in row["steps"].split("|") if s.strip()] if row.get("steps") else [],
-                    "tags": [t.strip() for t in (row.get("tags") or "").split(",") if t.strip()],
+                    "title": row[i_title].strip(),
+                    "ingredients": dict(_ING_RE.findall(row[i_ing])),
+                    "steps": _STEPS_RE.findall(row[i_steps]),
+                    "tags": _TAGS_RE.findall(row[i_tags]) if i_tags is not None else [],
                 }
-                if row.get("servings"):
-                    recipe["servings"] = row["servings"].strip()
-                if row.get("source_url"):
-                    recipe["source_url"] = row["source_url"].strip()
+                if i_servings is not None and row[i_servings]:
+                    recipe["servings"] = row[i_servings].strip()
+                if i_url is not None and row[i_url]:
+                    recipe["source_url"] = row[i_url].strip()
                 yield recipe
 
     source = {"json": iter_json, "jsonl": iter_jsonl, "csv": iter_csv}[fmt]()
@@ -260,13 +285,28 @@ def _coerce_recipe(r: dict) -> Recipe:
 def export_cmd(ctx, fmt, outfile):
     """Export all recipes."""
     store: Storage = ctx.obj["STORE"]
-    if fmt == "jsonl":
-        with open(outfile, "w", encoding="utf-8") as f:
+    with open(outfile, "wb", buffering=1 << 20) as f:
+        if fmt == "jsonl":
             for r in store.export_iter():
-                f.write(json.dumps(r, ensure_ascii=False) + "\n")
-    else:
-        with open(outfile, "w", encoding="utf-8") as f:
-            json.dump(list(store.export_iter()), f, ensure_ascii=False, indent=2)
+                f.write(json_dumpb(r))
+                f.write(b"\n")
+        else:
+            # Indented output needs the encoder's own options, so pick it here
+            orjson = _optional("orjson")
+            if orjson:
+                def dumps_indent(r):
+                    return orjson.dumps(r, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+            else:
+                import json
+                def dumps_indent(r):
+                    return json.dumps(r, ensure_ascii=False, indent=2).encode("utf-8")
+            # Stream the array record by record (same layout as an indented dump of the full list)
+            sep = b"[\n  "
+            for r in store.export_iter():
+                f.write(sep)
+                f.write(dumps_indent(r).replace(b"\n", b"\n  "))
+                sep = b",\n  "
+            f.write(b"[]" if sep == b"[\n  " else b"\n]")
     click.echo(f"Exported to {outfile}")
 
 @cli.command(name='snapshot')
@@ -277,17 +317,17 @@ def snapshot_cmd(ctx, outfile):
     Emit a single-file, denormalised JSON snapshot for publishing:
     [{title, tags, ingredients:[{name, amount}], steps:[...]}, ...]
     """
-    store: Storage = ctx.obj["STORE"]
-    pub = []
-    for r in store.list_recipes():
-        pub.append({
+    pub = [
+        {
             "title": r["title"],
             "tags": r.get("tags", []),
             "ingredients": [{"name": k, "amount": v} for k, v in r.get("ingredients", {}).items()],
             "steps": r.get("steps", []),
-        })
-    with open(outfile, "w", encoding="utf-8") as f:
-        json.dump(pub, f, ensure_ascii=False)
+        }
+        for r in ctx.obj["STORE"].export_iter()  # streamed; the raw recipe list is never built
+    ]
+    with open(outfile, "wb") as f:
+        f.write(json_dumpb(pub))
     click.echo(f"Wrote snapshot: {outfile}")
 
 # ---------------------------
@@ -295,28 +335,31 @@ def snapshot_cmd(ctx, outfile):
 # ---------------------------
 
 @cli.command(name='migrate-from-orm')
-@click.option('--module', default='models', help='Python module that defines SessionLocal and Recipe (default: models)')
+@click.option('--module', default='models', help='Python module that defines SessionLocal (or SESSION) and Recipe (default: models)')
 @click.pass_context
 def migrate_from_orm(ctx, module):
     """Migrate all recipes from an existing SQLAlchemy ORM DB into the current storage."""
     store: Storage = ctx.obj["STORE"]
     try:
-        orm = __import__(module, fromlist=['SessionLocal', 'Recipe'])
-        SessionLocal = getattr(orm, 'SessionLocal')
+        orm = __import__(module, fromlist=['SESSION', 'SessionLocal', 'Recipe'])
+        # Prefer the module's shared scoped session over a fresh sessionmaker
+        Session = getattr(orm, 'SESSION', None) or getattr(orm, 'SessionLocal')
         RecipeModel = getattr(orm, 'Recipe')
     except Exception as e:
         raise click.ClickException(f"Could not import ORM module '{module}': {e}")
 
-    session = SessionLocal()
-    added = 0
+    session = Session()
+    batch = []
+    # Titles already stored (and queued), checked in memory instead of one lookup per row
+    existing = store.title_keys()
     try:
         rows = session.query(RecipeModel).all()
         for row in rows:
             title = (row.title or '').strip()
-            if not title:
-                continue
-            if store.get_recipe(title):
+            key = title.lower()
+            if not title or key in existing:
                 continue
+            existing.add(key)
             # Map ORM shape -> storage
             # Assuming ORM uses: ingredients as list of {"name","quantity"}, steps as list[str], tags as list[str]
             ing = {}
@@ -331,12 +374,15 @@ def migrate_from_orm(ctx, module):
                 "steps": list(row.steps or []),
                 "tags": list(row.tags or []),
             }
-            store.add_recipe(r)
-            added += 1
+            batch.append(r)
+        store.add_many(batch)
         store.save()
     finally:
-        session.close()
-    click.echo(f"Migrated {added} recipe(s) from ORM into {ctx.obj['DB_PATH']}")
+        if hasattr(Session, 'remove'):
+            Session.remove()
+        else:
+            session.close()
+    click.echo(f"Migrated {len(batch)} recipe(s) from ORM into {ctx.obj['DB_PATH']}")
 
 if __name__ == '__main__':
     cli()
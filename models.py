@@ -1,9 +1,10 @@
 # models.py
 # ---------
 import json
-from sqlalchemy import Column, Integer, String, JSON, create_engine
+from sqlalchemy import Column, Integer, String, JSON, create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import StaticPool
 
 Base = declarative_base()
 
@@ -15,8 +16,27 @@ class Recipe(Base):
     steps = Column(JSON, nullable=False)
     tags = Column(JSON, nullable=True)
 
-engine = create_engine('sqlite:///recipes.db')
+# One shared connection per process; sessions reuse it instead of reconnecting
+engine = create_engine(
+    'sqlite:///recipes.db',
+    connect_args={'check_same_thread': False},
+    poolclass=StaticPool,
+)
+
+@event.listens_for(engine, 'connect')
+def _set_sqlite_pragmas(dbapi_con, _record):
+    """Tune SQLite for batch inserts and read-heavy use (WAL, bigger cache, fewer fsyncs)."""
+    cur = dbapi_con.cursor()
+    cur.execute('PRAGMA journal_mode=WAL')
+    cur.execute('PRAGMA synchronous=NORMAL')
+    cur.execute('PRAGMA cache_size=-64000')
+    cur.execute('PRAGMA temp_store=MEMORY')
+    cur.execute('PRAGMA mmap_size=268435456')
+    cur.execute('PRAGMA wal_autocheckpoint=1000')
+    cur.close()
+
 SessionLocal = sessionmaker(bind=engine)
+SESSION = scoped_session(SessionLocal)
 
 def init_db():
     """Create database tables."""
@@ -30,7 +50,7 @@ def drop_db():
 
 def add_sample_data():
     """Insert sample recipes if they don't already exist."""
-    session = SessionLocal()
+    session = SESSION()
     # Define sample recipes
     sample = [
         {
@@ -69,13 +89,9 @@ def add_sample_data():
             'tags': ['lunch', 'gluten-free']
         }
     ]
-    # refresh samples
-    for data in sample:
-        existing = session.query(Recipe).filter_by(title=data['title']).first()
-        if existing:
-            session.delete(existing)
-    session.commit()
-    for data in sample:
-        session.add(Recipe(**data))
+    # refresh samples: one DELETE plus one batched INSERT, in a single transaction
+    titles = [d['title'] for d in sample]
+    session.query(Recipe).filter(Recipe.title.in_(titles)).delete(synchronize_session=False)
+    session.bulk_insert_mappings(Recipe, sample)
     session.commit()
-    session.close()
\ No newline at end of file
+    SESSION.remove()
\ No newline at end of file
@@ -1,24 +1,102 @@
 # storage.py
 # ------
-from typing import Iterable, Optional, Dict, Any, List, Tuple
+import re
+from decimal import Decimal
+from typing import Iterable, Optional, Dict, Any, List, Set, Tuple, Union
+
+# JSON codec shared by the backends: orjson when installed, stdlib json otherwise
+try:
+    import orjson
+    json_loads = orjson.loads                       # accepts str or bytes
+    json_dumpb = orjson.dumps                       # already bytes; bound directly, no wrapper call
+    def json_dumps(o: Any) -> str:
+        return orjson.dumps(o).decode("utf-8")
+except ImportError:
+    import json
+    json_loads = json.loads
+    def json_dumps(o: Any) -> str:
+        return json.dumps(o, ensure_ascii=False)
+    def json_dumpb(o: Any) -> bytes:
+        return json.dumps(o, ensure_ascii=False).encode("utf-8")
 
 Recipe = Dict[str, Any]        # title, steps(list[str]), tags(list[str]), ingredients(dict[str,str]), servings?, source_url?
 GroceryLine = Tuple[str, str]  # (ingredient_name, amount)
+TagFilter = Union[None, str, Iterable[str]]  # one tag, or several that must all match
+
+def norm_title(t: str) -> str:
+    """Case- and whitespace-insensitive title key used for lookups and de-duplication."""
+    return t.strip().lower()
+
+def as_tags(tag: TagFilter) -> Tuple[str, ...]:
+    """Normalise a tag filter to a tuple of tags."""
+    if tag is None:
+        return ()
+    if isinstance(tag, str):
+        return (tag,)
+    return tuple(tag)
+
+_AMOUNT_RE = re.compile(r'\s*(\d+(?:\.\d+)?)\s*([A-Za-z][A-Za-z ]*?)?\s*$')  # "200 g", "3 cloves", "1"
+
+def _merge_amounts(amounts: List[str]) -> str:
+    """Sum amounts that share a unit ("200 g" + "100 g" -> "300 g"); keep the rest verbatim, in first-seen order."""
+    if len(amounts) == 1:
+        return amounts[0]
+    by_unit: Dict[str, List] = {}  # unit key -> [Decimal total, display unit, raw amounts]
+    order: List = []  # unparsed amounts, and each unit's slot where that unit first appeared
+    for a in amounts:
+        m = _AMOUNT_RE.match(a)
+        if not m:
+            if a.strip():
+                order.append(a.strip())
+            continue
+        unit = m.group(2) or ""
+        slot = by_unit.get(unit.lower())
+        if slot is None:
+            slot = by_unit[unit.lower()] = [Decimal(0), unit, []]
+            order.append(slot)
+        slot[0] += Decimal(m.group(1))  # decimal, not float: 0.1 + 0.2 stays 0.3
+        slot[2].append(a)
+    parts = []
+    for p in order:
+        if isinstance(p, str):
+            parts.append(p)
+            continue
+        total, unit, raws = p
+        if len(raws) == 1:
+            parts.append(raws[0])
+        else:
+            num = format(total.normalize(), "f")  # plain digits, never exponent form
+            parts.append(f"{num} {unit}" if unit else num)
+    return ", ".join(parts)
+
+def grocery_lines(recipes: Iterable[Recipe]) -> List[GroceryLine]:
+    """One line per ingredient (matched case-insensitively) across all recipes, in first-seen order."""
+    agg: Dict[str, Tuple[str, List[str]]] = {}
+    for r in recipes:
+        for ing, amt in r.get("ingredients", {}).items():
+            # JSON imports can carry numeric amounts ({"egg": 2}); lines are text
+            agg.setdefault(ing.strip().lower(), (ing, []))[1].append(str(amt))
+    return [(name, _merge_amounts(amts)) for name, amts in agg.values()]
 
 class Storage:
     """Abstract recipe storage."""
 
     # Basic CRUD
     def list_recipes(self) -> List[Recipe]: ...
+    def list_titles(self) -> List[str]: ...  # titles only, in list_recipes order
     def get_recipe(self, title: str) -> Optional[Recipe]: ...
+    def has_title(self, title: str) -> bool: ...
+    def title_keys(self) -> Set[str]: ...  # norm_title() of every stored title
     def add_recipe(self, recipe: Recipe) -> None: ...
     def delete_recipe(self, title: str) -> bool: ...
     def save(self) -> None: ...
+    def close(self) -> None: ...
 
     # Convenience
-    def random_recipes(self, n: int = 1, tag: Optional[str] = None) -> List[Recipe]: ...
+    def random_recipes(self, n: int = 1, tag: TagFilter = None) -> List[Recipe]: ...
     def grocery_list(self, recipes: List[Recipe]) -> List[GroceryLine]: ...
 
     # Bulk helpers
+    def add_many(self, recipes: Iterable[Recipe]) -> None: ...
     def import_iter(self, recipes: Iterable[Recipe]) -> int: ...
     def export_iter(self) -> Iterable[Recipe]: ...
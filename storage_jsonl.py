@@ -1,67 +1,149 @@
 # storage_jsonl.py
-import json, random
+import mmap, os, random
 from pathlib import Path
-from typing import List, Dict, Any, Optional, Iterable, Tuple
-from storage import Storage, Recipe, GroceryLine
-
-def _norm_title(t: str) -> str:
-    return t.strip().lower()
+from typing import List, Dict, Any, Optional, Iterable, Set, Tuple
+from storage import Storage, Recipe, GroceryLine, as_tags, grocery_lines, json_loads, json_dumpb, norm_title as _norm_title
 
 class JsonlStorage(Storage):
     def __init__(self, path: Path):
         self.path = path
-        self._recipes: List[Recipe] = []
-        if path.exists():
-            with path.open(encoding="utf-8") as f:
-                self._recipes = [json.loads(line) for line in f if line.strip()]
+        # Every record, in file order; this is what save() and export_iter() write
+        self._rows: List[Recipe] = []
+        # Normalised title -> first record with that title, for lookups
+        self._recipes: Dict[str, Recipe] = {}
+        # Titles held by more than one record (legacy files with case-only differences)
+        self._dupes: Set[str] = set()
+        # Inverted tag index: tag -> {id(record): record} for every record carrying it.
+        # Built on the first tagged query, then kept in step with _rows.
+        self._by_tag: Optional[Dict[str, Dict[int, Recipe]]] = None
+        if path.exists() and path.stat().st_size:  # mmap cannot map an empty file
+            with path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if mm[:1024].lstrip()[:1] == b"[":
+                    # A single JSON array (e.g. an `export --fmt json` file) parses in one call
+                    loaded = json_loads(mm[:])
+                else:
+                    # Lines are sliced straight off the mapping; the file is never held
+                    # in memory as one bytes object alongside a list of its lines
+                    loaded = (json_loads(line) for line in iter(mm.readline, b"") if line.strip())
+                for r in loaded:
+                    t = _norm_title(r["title"])
+                    if self._recipes.setdefault(t, r) is not r:
+                        self._dupes.add(t)  # kept, not dropped: get_recipe() still returns the first
+                    self._rows.append(r)
 
     def save(self) -> None:
         self.path.parent.mkdir(parents=True, exist_ok=True)
-        with self.path.open("w", encoding="utf-8") as f:
-            for r in self._recipes:
-                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+        # Serialise everything up front, write it once to a temp file, then swap it in
+        # atomically so a crash mid-save never leaves a truncated database.
+        payload = b"\n".join(map(json_dumpb, self._rows))
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        with tmp.open("wb") as f:
+            f.write(payload)
+            if payload:
+                f.write(b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
 
     def list_recipes(self) -> List[Recipe]:
-        return list(self._recipes)
+        return list(self._rows)
+
+    def list_titles(self) -> List[str]:
+        return [r["title"] for r in self._rows]
 
     def get_recipe(self, title: str) -> Optional[Recipe]:
-        t = _norm_title(title)
-        return next((r for r in self._recipes if _norm_title(r["title"]) == t), None)
+        return self._recipes.get(_norm_title(title))
+
+    def has_title(self, title: str) -> bool:
+        return _norm_title(title) in self._recipes
+
+    def title_keys(self) -> Set[str]:
+        return set(self._recipes)
 
     def add_recipe(self, recipe: Recipe) -> None:
-        if self.get_recipe(recipe["title"]):
+        t = _norm_title(recipe["title"])
+        if t in self._recipes:
             raise ValueError(f"Recipe with title '{recipe['title']}' already exists")
-        # Normalise shape
+        self._insert(t, recipe)
+
+    def _insert(self, t: str, recipe: Recipe) -> None:
+        # t is the already-normalised title; normalise the recipe's shape
         recipe.setdefault("tags", [])
         recipe.setdefault("steps", [])
         recipe.setdefault("ingredients", {})
-        self._recipes.append(recipe)
+        self._recipes[t] = recipe
+        self._rows.append(recipe)
+        if self._by_tag is not None:
+            self._index_tags(self._by_tag, recipe)
 
     def delete_recipe(self, title: str) -> bool:
-        before = len(self._recipes)
-        self._recipes = [r for r in self._recipes if _norm_title(r["title"]) != _norm_title(title)]
-        return len(self._recipes) < before
+        # Removes every record with this title, as the full-scan version did
+        t = _norm_title(title)
+        r = self._recipes.pop(t, None)
+        if r is None:
+            return False
+        if t in self._dupes:
+            self._dupes.discard(t)
+            gone = [x for x in self._rows if _norm_title(x["title"]) == t]
+            self._rows = [x for x in self._rows if _norm_title(x["title"]) != t]
+        else:
+            gone = [r]
+            self._rows.remove(r)  # any equal record would share its title, so this is r
+        if self._by_tag is not None:
+            for x in gone:
+                for tag in x.get("tags") or ():
+                    recs = self._by_tag.get(tag)
+                    if recs is not None:
+                        recs.pop(id(x), None)
+                        if not recs:
+                            del self._by_tag[tag]
+        return True
+
+    @staticmethod
+    def _index_tags(by_tag: Dict[str, Dict[int, Recipe]], recipe: Recipe) -> None:
+        for tag in recipe.get("tags") or ():
+            by_tag.setdefault(tag, {})[id(recipe)] = recipe
+
+    def _tag_index(self) -> Dict[str, Dict[int, Recipe]]:
+        if self._by_tag is None:
+            by_tag: Dict[str, Dict[int, Recipe]] = {}
+            for r in self._rows:
+                self._index_tags(by_tag, r)
+            self._by_tag = by_tag
+        return self._by_tag
 
     def random_recipes(self, n=1, tag=None) -> List[Recipe]:
-        pool = self._recipes if not tag else [r for r in self._recipes if tag in r.get("tags", [])]
-        if not pool:
-            return []
-        return random.sample(pool, k=min(n, len(pool)))
+        tagset = set(as_tags(tag))
+        if tagset:
+            by_tag = self._tag_index()
+            if not tagset.issubset(by_tag):
+                return []
+            # Intersect the matching record sets, smallest first; non-matching recipes are never visited
+            first, *rest = sorted((by_tag[t] for t in tagset), key=len)
+            keys = [k for k in first if all(k in recs for recs in rest)] if rest else list(first)
+            if not keys:
+                return []
+            # Sample record keys; only the winners are looked up
+            picks = random.sample(keys, k=min(n, len(keys)))
+            return [first[k] for k in picks]
+        # Sample the stored list in place; no per-call copy of the pool
+        return random.sample(self._rows, k=min(n, len(self._rows)))
 
     def grocery_list(self, recipes: List[Recipe]) -> List[GroceryLine]:
-        lines: List[GroceryLine] = []
+        return grocery_lines(recipes)
+
+    def add_many(self, recipes: Iterable[Recipe]) -> None:
         for r in recipes:
-            for ing, amt in r.get("ingredients", {}).items():
-                lines.append((ing, amt))
-        return lines
+            self.add_recipe(r)
 
     def import_iter(self, recipes: Iterable[Recipe]) -> int:
         c = 0
         for r in recipes:
-            if not self.get_recipe(r["title"]):
-                self.add_recipe(r)
+            t = _norm_title(r["title"])  # normalised once per row, not per check + insert
+            if t not in self._recipes:
+                self._insert(t, r)
                 c += 1
         return c
 
     def export_iter(self) -> Iterable[Recipe]:
-        yield from self._recipes
\ No newline at end of file
+        yield from self._rows
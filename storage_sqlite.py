@@ -1,7 +1,7 @@
 # storage_sqlite.py
-import json, sqlite3, random
-from typing import List, Dict, Any, Optional, Iterable, Tuple
-from storage import Storage, Recipe, GroceryLine
+import sqlite3, random
+from typing import List, Dict, Any, Optional, Iterable, Set, Tuple
+from storage import Storage, Recipe, GroceryLine, as_tags, grocery_lines, json_loads, json_dumps, norm_title
 
 DDL = """
 CREATE TABLE IF NOT EXISTS recipes(
@@ -11,85 +11,233 @@ CREATE TABLE IF NOT EXISTS recipes(
   ingredients_json TEXT NOT NULL,
   tags_json TEXT NOT NULL,
   servings TEXT,
-  source_url TEXT
+  source_url TEXT,
+  title_norm TEXT
 );
 """
+# One row per (tag, recipe), kept in sync by triggers so every insert/delete path maintains it
+TAGS_DDL = """
+CREATE TABLE IF NOT EXISTS recipe_tags(
+  tag TEXT NOT NULL,
+  recipe_id INTEGER NOT NULL,
+  PRIMARY KEY(tag, recipe_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_recipe_tags_recipe ON recipe_tags(recipe_id);
+CREATE TRIGGER IF NOT EXISTS trg_recipes_tags_ins AFTER INSERT ON recipes BEGIN
+  INSERT INTO recipe_tags(tag, recipe_id) SELECT DISTINCT value, NEW.id FROM json_each(NEW.tags_json);
+END;
+CREATE TRIGGER IF NOT EXISTS trg_recipes_tags_del AFTER DELETE ON recipes BEGIN
+  DELETE FROM recipe_tags WHERE recipe_id=OLD.id;
+END;
+"""
+TAGS_BACKFILL_SQL = "INSERT OR IGNORE INTO recipe_tags(tag, recipe_id) SELECT j.value, r.id FROM recipes r, json_each(r.tags_json) j"
+
+# title_norm holds norm_title(title) so lookups are indexed equality probes, not lower() scans.
+# The UNIQUE index also makes INSERT OR IGNORE drop case-insensitive duplicates by itself.
+UNIQUE_INDEX_DDL = "CREATE UNIQUE INDEX IF NOT EXISTS ux_recipes_title_norm ON recipes(title_norm)"
+# Fallback for legacy databases that already hold titles differing only in case
+INDEX_DDL = "CREATE INDEX IF NOT EXISTS ix_recipes_title_norm ON recipes(title_norm)"
+HAS_UNIQUE_INDEX_SQL = "SELECT 1 FROM sqlite_master WHERE type='index' AND name='ux_recipes_title_norm'"
+DUP_TITLES_SQL = "SELECT 1 FROM recipes GROUP BY title_norm HAVING COUNT(*)>1 LIMIT 1"  # walks ix_recipes_title_norm
+# PRAGMA user_version flag: the duplicate scan found case-duplicates, so later opens skip it
+DUP_TITLES_FLAG = 1
 
 def _row_to_recipe(row) -> Recipe:
-    _, title, steps, ings, tags, servings, url = row
+    # Rows stay plain tuples: one positional unpack of the six _COLS beats sqlite3.Row name lookups
+    title, steps, ings, tags, servings, url = row
     r: Recipe = {
         "title": title,
-        "steps": json.loads(steps),
-        "ingredients": json.loads(ings),
-        "tags": json.loads(tags),
+        "steps": json_loads(steps),
+        "ingredients": json_loads(ings),
+        "tags": json_loads(tags),
     }
     if servings is not None: r["servings"] = servings
     if url: r["source_url"] = url
     return r
 
+# Constant SQL text so sqlite3's per-connection statement cache reuses the prepared statements
+_COLS = "title,steps_json,ingredients_json,tags_json,servings,source_url"  # the fields _row_to_recipe reads
+GET_SQL = f"SELECT {_COLS} FROM recipes WHERE title_norm=?"
+LIST_SQL = f"SELECT {_COLS} FROM recipes ORDER BY title"
+LIST_TITLES_SQL = "SELECT title FROM recipes ORDER BY title"  # covered by the UNIQUE(title) index
+HAS_TITLE_SQL = "SELECT 1 FROM recipes WHERE title_norm=? LIMIT 1"
+DELETE_SQL = "DELETE FROM recipes WHERE title_norm=?"
+INSERT_SQL = "INSERT INTO recipes(title,steps_json,ingredients_json,tags_json,servings,source_url,title_norm) VALUES (?,?,?,?,?,?,?)"
+INSERT_OR_IGNORE_SQL = INSERT_SQL.replace("INSERT", "INSERT OR IGNORE", 1)
+
+# Untagged random picks on big tables probe random rowids instead of shuffling every id
+PROBE_MIN_ROWS = 10000   # below this, ORDER BY RANDOM() over ids is already cheap
+PROBE_OVERSAMPLE = 4
+PROBE_MAX_IDS = 999      # keep the IN (...) list under SQLite's old bound-parameter limit
+
+def _recipe_to_row(r: Recipe) -> tuple:
+    # Shared by add_recipe, add_many and import_iter; each field is read once and
+    # empty collections skip the encoder entirely
+    title = r["title"]
+    steps, ings, tags = r.get("steps"), r.get("ingredients"), r.get("tags")
+    servings = r.get("servings")
+    return (
+        title,
+        json_dumps(steps) if steps else "[]",
+        json_dumps(ings) if ings else "{}",
+        json_dumps(tags) if tags else "[]",
+        None if servings is None else str(servings),
+        r.get("source_url"),
+        norm_title(title),
+    )
+
 class SqliteStorage(Storage):
     def __init__(self, path: str):
         self.con = sqlite3.connect(path)
+        # WAL + NORMAL sync: commits no longer fsync the main DB file each time.
+        # mmap lets reads come straight from the OS page cache; bigger page cache, temp tables in RAM.
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.execute("PRAGMA mmap_size=268435456")
+        self.con.execute("PRAGMA cache_size=-65536")
+        self.con.execute("PRAGMA temp_store=MEMORY")
         self.con.execute(DDL)
+        self._migrate_title_norm()
+        self._unique_titles = self._ensure_title_index()
+        have_tags = self.con.execute("SELECT 1 FROM sqlite_master WHERE name='recipe_tags'").fetchone()
+        self.con.executescript(TAGS_DDL)
+        if not have_tags:
+            with self.con:
+                self.con.execute(TAGS_BACKFILL_SQL)
+
+    def _ensure_title_index(self) -> bool:
+        if self.con.execute(HAS_UNIQUE_INDEX_SQL).fetchone():
+            return True
+        # Legacy path: keep the plain index, and only build the unique one once an indexed
+        # scan shows no case-duplicate titles, so opens never rebuild an index doomed to fail.
+        # A found duplicate is remembered until a delete clears it (see delete_recipe).
+        self.con.execute(INDEX_DDL)
+        (version,) = self.con.execute("PRAGMA user_version").fetchone()
+        if version & DUP_TITLES_FLAG:
+            return False
+        if self.con.execute(DUP_TITLES_SQL).fetchone():
+            self.con.execute("PRAGMA user_version=%d" % (version | DUP_TITLES_FLAG))
+            return False
+        try:
+            self.con.execute(UNIQUE_INDEX_DDL)
+        except sqlite3.IntegrityError:
+            return False
+        self.con.execute("DROP INDEX IF EXISTS ix_recipes_title_norm")  # superseded plain index
+        return True
+
+    def _migrate_title_norm(self) -> None:
+        # Databases created before title_norm existed get the column and a one-off backfill
+        cols = {row[1] for row in self.con.execute("PRAGMA table_info(recipes)")}
+        if "title_norm" in cols:
+            return
+        self.con.execute("ALTER TABLE recipes ADD COLUMN title_norm TEXT")
+        rows = [(norm_title(t), i) for i, t in self.con.execute("SELECT id, title FROM recipes")]
+        self.con.executemany("UPDATE recipes SET title_norm=? WHERE id=?", rows)
+        self.con.commit()
 
     def save(self) -> None:
         self.con.commit()
 
+    def close(self) -> None:
+        self.con.close()
+
     def list_recipes(self) -> List[Recipe]:
-        cur = self.con.execute("SELECT * FROM recipes ORDER BY title")
-        return [_row_to_recipe(r) for r in cur.fetchall()]
+        return list(self.export_iter())
+
+    def list_titles(self) -> List[str]:
+        # No JSON columns read or decoded
+        return [t for (t,) in self.con.execute(LIST_TITLES_SQL)]
 
     def get_recipe(self, title: str) -> Optional[Recipe]:
-        cur = self.con.execute("SELECT * FROM recipes WHERE lower(title)=lower(?)", (title.strip(),))
-        row = cur.fetchone()
+        row = self.con.execute(GET_SQL, (norm_title(title),)).fetchone()
         return _row_to_recipe(row) if row else None
 
+    def has_title(self, title: str) -> bool:
+        return self.con.execute(HAS_TITLE_SQL, (norm_title(title),)).fetchone() is not None
+
+    def title_keys(self) -> Set[str]:
+        return {t for (t,) in self.con.execute("SELECT title_norm FROM recipes")}
+
     def add_recipe(self, r: Recipe) -> None:
-        r = {**r}  # shallow copy
-        r.setdefault("tags", [])
-        r.setdefault("steps", [])
-        r.setdefault("ingredients", {})
-        self.con.execute(
-            "INSERT INTO recipes(title,steps_json,ingredients_json,tags_json,servings,source_url) VALUES (?,?,?,?,?,?)",
-            (
-                r["title"],
-                json.dumps(r["steps"], ensure_ascii=False),
-                json.dumps(r["ingredients"], ensure_ascii=False),
-                json.dumps(r["tags"], ensure_ascii=False),
-                str(r.get("servings")) if r.get("servings") is not None else None,
-                r.get("source_url"),
-            ),
-        )
+        self.con.execute(INSERT_SQL, _recipe_to_row(r))
+
+    def add_many(self, recipes: Iterable[Recipe]) -> None:
+        # One prepared INSERT reused for every row
+        self.con.executemany(INSERT_SQL, (_recipe_to_row(r) for r in recipes))
 
     def delete_recipe(self, title: str) -> bool:
-        cur = self.con.execute("DELETE FROM recipes WHERE lower(title)=lower(?)", (title.strip(),))
+        cur = self.con.execute(DELETE_SQL, (norm_title(title),))
+        if cur.rowcount and not self._unique_titles:
+            # The delete may have removed the last duplicate; re-check on the next open
+            (version,) = self.con.execute("PRAGMA user_version").fetchone()
+            self.con.execute("PRAGMA user_version=%d" % (version & ~DUP_TITLES_FLAG))
         return cur.rowcount > 0
 
     def random_recipes(self, n=1, tag=None) -> List[Recipe]:
-        if tag:
-            cur = self.con.execute("SELECT * FROM recipes")
-            pool = [_row_to_recipe(r) for r in cur.fetchall() if tag in json.loads(r[4])]
+        # Filter and sample inside SQLite so only the picked rows get decoded
+        tags = tuple(dict.fromkeys(as_tags(tag)))
+        if not tags:
+            picked = self._probe_random_ids(n)
+            if picked is not None:
+                return self._fetch_ids(picked)
+        if len(tags) == 1:
+            # The (tag, recipe_id) primary key yields distinct ids straight off the index
+            ids = "SELECT recipe_id FROM recipe_tags WHERE tag=?"
+        elif tags:
+            # Indexed lookup in recipe_tags; a recipe qualifies when it carries every requested tag
+            ids = ("SELECT recipe_id FROM recipe_tags WHERE tag IN (%s) GROUP BY recipe_id HAVING COUNT(*)=%d"
+                   % (",".join("?" * len(tags)), len(tags)))
         else:
-            cur = self.con.execute("SELECT * FROM recipes")
-            pool = [_row_to_recipe(r) for r in cur.fetchall()]
-        if not pool:
-            return []
-        return random.sample(pool, k=min(n, len(pool)))
+            ids = "SELECT id FROM recipes"
+        # Shuffle bare ids, then fetch full rows only for the n winners
+        sql = f"SELECT {_COLS} FROM recipes WHERE id IN ({ids} ORDER BY RANDOM() LIMIT ?)"
+        rows = self.con.execute(sql, (*tags, n)).fetchall()
+        random.shuffle(rows)  # the outer IN lookup returns rows in id order
+        return [_row_to_recipe(r) for r in rows]
+
+    def _probe_random_ids(self, n: int) -> Optional[List[int]]:
+        """Pick n existing ids by probing random rowids; None when a full shuffle is the better bet."""
+        (maxid,) = self.con.execute("SELECT max(id) FROM recipes").fetchone()
+        k = n * PROBE_OVERSAMPLE  # over-sample to ride out ids freed by deletes
+        if not maxid or maxid < PROBE_MIN_ROWS or k > min(maxid, PROBE_MAX_IDS):
+            return None
+        cand = random.sample(range(1, maxid + 1), k)
+        found = [i for (i,) in self.con.execute(
+            "SELECT id FROM recipes WHERE id IN (%s)" % ",".join("?" * k), cand)]
+        if len(found) < n:
+            return None
+        return random.sample(found, n)
+
+    def _fetch_ids(self, ids: List[int]) -> List[Recipe]:
+        rows = {r[0]: r[1:] for r in self.con.execute(
+            f"SELECT id,{_COLS} FROM recipes WHERE id IN (%s)" % ",".join("?" * len(ids)), ids)}
+        return [_row_to_recipe(rows[i]) for i in ids]
 
     def grocery_list(self, recipes: List[Recipe]) -> List[GroceryLine]:
-        lines: List[GroceryLine] = []
-        for r in recipes:
-            for ing, amt in r.get("ingredients", {}).items():
-                lines.append((ing, amt))
-        return lines
+        return grocery_lines(recipes)
 
     def import_iter(self, recipes: Iterable[Recipe]) -> int:
-        c = 0
-        for r in recipes:
-            if not self.get_recipe(r["title"]):
-                self.add_recipe(r); c += 1
-        return c
+        # Rows stream straight into one executemany, committed as a single transaction.
+        # With the unique title_norm index SQLite skips duplicates itself; otherwise
+        # known titles are filtered in memory first.
+        if self._unique_titles:
+            rows = (_recipe_to_row(r) for r in recipes)
+        else:
+            seen = self.title_keys()
+
+            def dedup():
+                for r in recipes:
+                    t = norm_title(r["title"])
+                    if t not in seen:
+                        seen.add(t)
+                        yield _recipe_to_row(r)
+            rows = dedup()
+
+        with self.con:
+            cur = self.con.executemany(INSERT_OR_IGNORE_SQL, rows)
+        return cur.rowcount
 
     def export_iter(self) -> Iterable[Recipe]:
-        for r in self.list_recipes():
-            yield r
+        # Decode while iterating the cursor; nothing is materialised up front
+        for r in self.con.execute(LIST_SQL):
+            yield _row_to_recipe(r)
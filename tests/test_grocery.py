@@ -0,0 +1,52 @@
+# tests/test_grocery.py
+import unittest
+
+from storage import grocery_lines, _merge_amounts
+
+
+class MergeAmountsTest(unittest.TestCase):
+    def test_single_amount_is_kept_verbatim(self):
+        self.assertEqual(_merge_amounts(["200 g"]), "200 g")
+
+    def test_same_unit_is_summed(self):
+        self.assertEqual(_merge_amounts(["200 g", "100 g"]), "300 g")
+        self.assertEqual(_merge_amounts(["1 TSP", "1 tsp"]), "2 TSP")  # unit matched case-insensitively
+        self.assertEqual(_merge_amounts(["2", "1"]), "3")
+
+    def test_totals_are_exact(self):
+        self.assertEqual(_merge_amounts(["0.1 l", "0.2 l"]), "0.3 l")
+        self.assertEqual(_merge_amounts(["0.123456789012 g", "0.1 g"]), "0.223456789012 g")
+        self.assertEqual(_merge_amounts(["600000 g", "600000 g"]), "1200000 g")
+        self.assertEqual(_merge_amounts(["11111111111111111111 g", "1 g"]), "11111111111111111112 g")
+        self.assertEqual(_merge_amounts(["1.50", "2.50"]), "4")
+
+    def test_different_units_stay_apart(self):
+        self.assertEqual(_merge_amounts(["1 cup", "2 cups"]), "1 cup, 2 cups")
+
+    def test_unparsed_amounts_keep_first_seen_order(self):
+        self.assertEqual(_merge_amounts(["1 cup", "1/2 cup", "2 cup"]), "3 cup, 1/2 cup")
+        self.assertEqual(_merge_amounts(["pinch", "1 tsp", "1 tsp"]), "pinch, 2 tsp")
+        self.assertEqual(_merge_amounts(["to taste", " ", "1 g", "to taste"]), "to taste, 1 g, to taste")
+
+
+class GroceryLinesTest(unittest.TestCase):
+    def test_ingredients_merge_case_insensitively_in_first_seen_order(self):
+        recipes = [
+            {"ingredients": {"Egg": "1", "flour": "100 g"}},
+            {"ingredients": {"salt": "pinch", "egg": "2"}},
+        ]
+        self.assertEqual(
+            grocery_lines(recipes),
+            [("Egg", "3"), ("flour", "100 g"), ("salt", "pinch")],
+        )
+
+    def test_numeric_amounts_are_text(self):
+        recipes = [{"ingredients": {"egg": 2}}, {"ingredients": {"egg": 1, "milk": 250}}]
+        self.assertEqual(grocery_lines(recipes), [("egg", "3"), ("milk", "250")])
+
+    def test_recipe_without_ingredients(self):
+        self.assertEqual(grocery_lines([{"title": "Water"}]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()